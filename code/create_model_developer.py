@@ -65,7 +65,7 @@ def main():
         raise NotImplementedError("modeler missing")
 
     with open(args.out_file, "wb") as f:
-        pickle.dump(clf, f)
+        pickle.dump(clf, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == "__main__":
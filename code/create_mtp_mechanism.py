@@ -1,24 +1,42 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import sys, os
-import time
 import argparse
 import pickle
 import logging
-import progressbar
-from typing import List, Dict
-
-import numpy as np
-import pandas as pd
 
 from hypothesis_tester import *
 from mtp_mechanisms import *
 
 
+# Constructors for each multiple testing mechanism, given the hypothesis tester and parsed args
+MTP_MECHS = {
+    "binary_thres_mtp": lambda hypo_tester, args: BinaryThresholdMTP(hypo_tester, args.alpha),
+    "weighted_bonferroni": lambda hypo_tester, args: WeightedBonferroniThresholdMTP(
+        hypo_tester, args.alpha, args.bad_attempt_thres
+    ),
+    "bonferroni": lambda hypo_tester, args: BonferroniThresholdMTP(hypo_tester, args.alpha),
+    "graphical_bonf": lambda hypo_tester, args: GraphicalBonfMTP(
+        hypo_tester, args.alpha, success_weight=args.success_weight
+    ),
+    "graphical_prespec": lambda hypo_tester, args: GraphicalParallelMTP(
+        hypo_tester,
+        args.alpha,
+        success_weight=args.success_weight,
+        first_pres_weight=args.first_pres_weight,
+        parallel_ratio=args.prespec_ratio,
+    ),
+    "graphical_ffs": lambda hypo_tester, args: GraphicalFFSMTP(
+        hypo_tester,
+        args.alpha,
+        success_weight=args.success_weight,
+    ),
+}
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="create mtp mechanism")
-    parser.add_argument("--mtp-mech", type=str, default="graphical_bonf", choices=["binary_thres_mtp", "weighted_bonferroni", "bonferroni", "graphical_bonf", "graphical_prespec", "graphical_ffs"], help="Multiple testing mechanism")
+    parser.add_argument("--mtp-mech", type=str, default="graphical_bonf", choices=list(MTP_MECHS.keys()), help="Multiple testing mechanism")
     parser.add_argument(
         "--hypo-tester", type=str, default="auc", choices=["log_lik", "auc", "calib_auc"]
     )
@@ -53,33 +71,10 @@ def main():
     hypo_tester = get_hypo_tester(args.hypo_tester)
 
     # Create MTP mech
-    if args.mtp_mech == "binary_thres_mtp":
-        mtp_mech = BinaryThresholdMTP(hypo_tester, args.alpha)
-    elif args.mtp_mech == "bonferroni":
-        mtp_mech = BonferroniThresholdMTP(hypo_tester, args.alpha)
-    elif args.mtp_mech == "weighted_bonferroni":
-        mtp_mech = WeightedBonferroniThresholdMTP(hypo_tester, args.alpha, args.bad_attempt_thres)
-    elif args.mtp_mech == "graphical_bonf":
-        mtp_mech = GraphicalBonfMTP(
-            hypo_tester, args.alpha, success_weight=args.success_weight
-        )
-    elif args.mtp_mech == "graphical_prespec":
-        mtp_mech = GraphicalParallelMTP(
-            hypo_tester,
-            args.alpha,
-            success_weight=args.success_weight,
-            first_pres_weight=args.first_pres_weight,
-            parallel_ratio=args.prespec_ratio,
-        )
-    elif args.mtp_mech == "graphical_ffs":
-        mtp_mech = GraphicalFFSMTP(
-            hypo_tester,
-            args.alpha,
-            success_weight=args.success_weight,
-        )
+    mtp_mech = MTP_MECHS[args.mtp_mech](hypo_tester, args)
 
     with open(args.out_file, "wb") as f:
-        pickle.dump(mtp_mech, f)
+        pickle.dump(mtp_mech, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
 if __name__ == "__main__":
@@ -7,7 +7,7 @@ import pandas as pd
 
 
 def make_safe_prob(p, eps=1e-10):
-    return np.maximum(eps, np.minimum(1 - eps, p))
+    return np.clip(p, eps, 1 - eps)
 
 
 
@@ -69,6 +69,51 @@ class Dataset:
             else None,
         )
 
+class DatasetBuffer:
+    """
+    Preallocated storage for a dataset that grows one batch at a time.
+    Appending a batch only copies that batch, rather than re-merging all the data seen so far.
+    The optional fields (mu, weight) are allocated if init_dat has them, and every appended batch must have the same fields.
+    Dataset.merge instead decides from the last dataset, which drops the field or fails to stack when the batches disagree.
+    """
+    fields = ["x", "y", "mu", "weight"]
+
+    def __init__(self, init_dat: Dataset, dat_stream: List[Dataset]):
+        """
+        @param init_dat: the initial data in the buffer
+        @param dat_stream: the batches that may be appended later, used to size the buffer
+        """
+        all_dats = [init_dat] + list(dat_stream)
+        total_n = sum([d.size for d in all_dats])
+        self._arrays = {}
+        for field in self.fields:
+            if getattr(init_dat, field) is None:
+                continue
+            dtype = np.result_type(*[getattr(d, field) for d in all_dats])
+            self._arrays[field] = np.empty((total_n, getattr(init_dat, field).shape[1]), dtype=dtype)
+        self.size = 0
+        self.append(init_dat)
+
+    def append(self, dat: Dataset):
+        for field in self.fields:
+            assert (getattr(dat, field) is not None) == (field in self._arrays), "batch is missing or adds %s" % field
+        new_size = self.size + dat.size
+        for field, arr in self._arrays.items():
+            arr[self.size:new_size] = getattr(dat, field)
+        self.size = new_size
+
+    @property
+    def dataset(self):
+        """
+        @return dataset of the rows appended so far (views into the buffer, later appends do not modify it)
+        """
+        return Dataset(
+            x=self._arrays["x"][:self.size],
+            y=self._arrays["y"][:self.size],
+            mu=self._arrays["mu"][:self.size] if "mu" in self._arrays else None,
+            weight=self._arrays["weight"][:self.size] if "weight" in self._arrays else None,
+        )
+
 class FullDataset:
     def __init__(
         self,
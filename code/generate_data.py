@@ -67,6 +67,7 @@ def main():
                 "betas": betas,
             },
             f,
+            protocol=pickle.HIGHEST_PROTOCOL,
         )
 
 
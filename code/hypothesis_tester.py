@@ -4,11 +4,13 @@ All hypotheses here evaluate candidate modifications using multiple performance
 """
 import logging
 from typing import List
-import subprocess
 
 import pandas as pd
 import numpy as np
 import scipy
+import scipy.optimize
+import scipy.stats
+from scipy.special import expit, ndtri
 import sklearn
 from sklearn.metrics import roc_auc_score
 from sklearn.linear_model import LogisticRegression, LinearRegression
@@ -18,32 +20,127 @@ from node import Node
 MAX_PARTICLES = 50000
 MIN_PARTICLES = 5000
 
+def get_pred_prob(mdl, x):
+    """
+    Logistic models are scored directly, which skips sklearn's input validation in predict_proba
+    @return predicted probability of y=1 for each row of x
+    """
+    if isinstance(mdl, LogisticRegression):
+        # reuse the logit array for the intercept and the sigmoid
+        pred_prob = x @ mdl.coef_[0]
+        pred_prob += mdl.intercept_[0]
+        return expit(pred_prob, out=pred_prob)
+    return mdl.predict_proba(x)[:,1]
+
 def get_log_lik(y_true, y_pred):
-    y_pred = np.minimum(np.maximum(y_pred, 1e-10), 1 - 1e-10)
-    return y_true * np.log(y_pred) + (1 - y_true) * np.log(1 - y_pred)
+    """
+    Labels are binary, so only one log term is needed per observation.
+    The result is computed in place in a single clipped copy of y_pred.
+    The labels are not checked here, soft labels would silently get the y=1 term.
+    @param y_true: hard 0/1 labels, with the same number of elements as y_pred
+    @param y_pred: predicted probability of y=1
+    @return log likelihood of each observation, in the shape of y_pred
+    """
+    y_true = np.reshape(y_true, np.shape(y_pred))
+    log_lik = np.clip(y_pred, 1e-10, 1 - 1e-10)
+    np.subtract(1, log_lik, out=log_lik, where=(y_true == 0))
+    return np.log(log_lik, out=log_lik)
+
+def get_sequential_boundary(cov_est, prior_bounds, alpha_spend: float, alt_greater: bool):
+    """
+    Solves for the threshold that spends alpha_spend in a sequential test,
+    given the acceptance regions of the prior test statistics
+    @param cov_est: covariance of the prior test statistics and the current one
+    @param prior_bounds: array with the lower and upper bound of each prior test statistic
+    @return the critical value for the current test statistic
+    """
+    cov_est = (cov_est + cov_est.T)/2
+    mean = np.zeros(cov_est.shape[0])
+
+    def get_sequential_spend_diff(thres):
+        lower_all = np.append(prior_bounds[:,0], thres if alt_greater else -np.inf)
+        upper_all = np.append(prior_bounds[:,1], np.inf if alt_greater else thres)
+        # The cdf is integrated by quasi-Monte Carlo. A fresh local generator keeps the global numpy seed untouched
+        # and integrates every threshold with the same points, so the root search sees a monotone function
+        mvn_dist = scipy.stats.multivariate_normal(
+            mean, cov_est, allow_singular=True, seed=np.random.default_rng(0), maxpts=50000, abseps=1e-5
+        )
+        reject_prob = mvn_dist.cdf(upper_all, lower_limit=lower_all)
+        return reject_prob - alpha_spend
+
+    if alt_greater:
+        search_bounds = (0, np.max(prior_bounds[:,1]) + 100)
+    else:
+        search_bounds = (np.min(prior_bounds[:,1]) - 100, 0)
+    # the cdf is only accurate to about 1e-5, so match the tolerance of R's uniroot rather than brentq's default
+    return scipy.optimize.brentq(get_sequential_spend_diff, *search_bounds, xtol=1e-4)
 
 
 class HypothesisTester:
-    def make_scratch(self, scratch_file: str):
-        self.scratch_file_cov = scratch_file.replace(".txt", "_cov.txt")
-        self.scratch_file_bounds = scratch_file.replace(".txt", "_bounds.txt")
-
     def get_auc(self, test_y, score_y):
-        score_y0 = score_y[test_y == 0]
+        score_y0 = np.sort(score_y[test_y == 0])
         score_y1 = score_y[test_y == 1]
 
         #assert np.all(np.isfinite(score_y0))
         #assert np.all(np.isfinite(score_y1))
 
-        all_ranks = score_y0.reshape((1,-1)) < score_y1.reshape((-1,1))
-        return np.mean(all_ranks)
+        # Count the pairs where the y=1 score strictly exceeds the y=0 score
+        num_ordered = np.searchsorted(score_y0, score_y1, side="left").sum()
+        return num_ordered / (score_y0.size * score_y1.size)
 
     def set_test_dat(self, test_dat):
         self.test_dat = test_dat
+        self._cached_mdl = None
+
+    @staticmethod
+    def _get_fitted_params(mdl):
+        """
+        @return copies of the fitted linear parameters, None if the model has none
+        """
+        if hasattr(mdl, "coef_"):
+            return np.copy(mdl.coef_), np.copy(mdl.intercept_)
+        return None
+
+    def _is_cached_mdl(self, mdl):
+        if getattr(self, "_cached_mdl", None) is not mdl:
+            return False
+        fitted_params = self._get_fitted_params(mdl)
+        if fitted_params is None:
+            return True
+        return all(np.array_equal(a, b) for a, b in zip(fitted_params, self._cached_mdl_params))
+
+    def _get_orig_influence_func(self, orig_mdl):
+        """
+        The original model is compared against every proposed modification,
+        so its influence function is only computed once per test dataset.
+        Linear models are also matched on their fitted parameters, so refitting them in place invalidates the cache.
+        Other models (e.g. tree ensembles) are matched by identity only and must not be refit in place.
+        @return influence function and estimate for the original model
+        """
+        if not self._is_cached_mdl(orig_mdl):
+            self._cached_mdl = orig_mdl
+            self._cached_mdl_params = self._get_fitted_params(orig_mdl)
+            self._cached_influence_func = self.get_influence_func(orig_mdl)
+        return self._cached_influence_func
 
     def get_observations(self, orig_mdl, new_mdl):
         raise NotImplementedError
 
+    def _get_cov_est(self, prior_nodes: List, node: Node):
+        """
+        Blocks between pairs of prior nodes are cached on the nodes,
+        so only the covariance with the current node is computed here
+        @return estimated covariance of the estimates for the prior nodes and the current node
+        """
+        nodes = prior_nodes + [node]
+        cov_blocks = [[None] * len(nodes) for _ in nodes]
+        for i, node_i in enumerate(nodes):
+            for j, node_j in enumerate(nodes[:i + 1]):
+                cross_cov = node_i.get_cross_cov(node_j)
+                cov_blocks[i][j] = cross_cov
+                cov_blocks[j][i] = cross_cov.T
+        return np.block(cov_blocks)/self.test_dat.size
+
     def test_null(self, node: Node, null_hypo: np.ndarray, prior_nodes: List):
         """
         @return the CI code this node, accounting for the previous nodes in the true
@@ -53,14 +150,21 @@ class HypothesisTester:
 
 class AUCHypothesisTester(HypothesisTester):
     def get_influence_func(self, mdl):
-        pred_y = mdl.predict_log_proba(self.test_dat.x)[:,1]
+        # AUC only depends on the ranking, so use the raw decision scores if the model has them
+        if hasattr(mdl, "decision_function"):
+            pred_y = mdl.decision_function(self.test_dat.x)
+        else:
+            pred_y = mdl.predict_log_proba(self.test_dat.x)[:,1]
         test_y = self.test_dat.y.flatten()
         prob_y1 = test_y.mean()
         prob_y0 = 1 - prob_y1
         mask_y0 = test_y == 0
         mask_y1 = test_y == 1
-        cdf_score_y0 = np.array([np.mean(pred_y[mask_y0] < pred_y[i]) for i in range(self.test_dat.size)])
-        cdf_score_y1 = np.array([np.mean(pred_y[mask_y1] > pred_y[i]) for i in range(self.test_dat.size)])
+        # Fraction of y=0 scores strictly below and y=1 scores strictly above each score
+        score_y0 = np.sort(pred_y[mask_y0])
+        score_y1 = np.sort(pred_y[mask_y1])
+        cdf_score_y0 = np.searchsorted(score_y0, pred_y, side="left") / score_y0.size
+        cdf_score_y1 = (score_y1.size - np.searchsorted(score_y1, pred_y, side="right")) / score_y1.size
         auc = self.get_auc(test_y, pred_y)
 
         # Note that this can actually be quite different!
@@ -75,17 +179,20 @@ class AUCHypothesisTester(HypothesisTester):
 
         return influence_func, auc
 
+    obs_names = ["auc_diff_ic"]
+
     def _get_observations(self, orig_mdl, new_mdl):
-        orig_auc_ic, orig_auc = self.get_influence_func(orig_mdl)
+        """
+        @return observations as an array with one column per name in obs_names, orig estimate, new estimate
+        """
+        orig_auc_ic, orig_auc = self._get_orig_influence_func(orig_mdl)
         new_auc_ic, new_auc = self.get_influence_func(new_mdl)
-        df = pd.DataFrame({
-            "auc_diff_ic": new_auc_ic - orig_auc_ic,
-            })
+        obs = (new_auc_ic - orig_auc_ic).reshape((-1, 1))
 
-        return df, orig_auc, new_auc
+        return obs, orig_auc, new_auc
 
     def get_observations(self, orig_mdl, new_mdl):
-        return self._get_observations(orig_mdl, new_mdl)[0]
+        return pd.DataFrame(self._get_observations(orig_mdl, new_mdl)[0], columns=self.obs_names)
 
     def test_null(self, alpha: float, node: Node, null_constraint: np.ndarray, prior_nodes: List = []):
         """
@@ -95,13 +202,10 @@ class AUCHypothesisTester(HypothesisTester):
         estimate = node.obs.to_numpy().mean()
         logging.info("test set estimate %.3f", estimate)
 
-        full_df = pd.concat([prior_node.obs for prior_node in prior_nodes] + [node.obs], axis=1).to_numpy().T
-        cov_est = np.cov(full_df)/self.test_dat.size
-        if full_df.shape[0] == 1:
-            cov_est = np.array([[cov_est]])
+        cov_est = self._get_cov_est(prior_nodes, node)
         #logging.info("cov est %s", cov_est)
         if np.any(np.isnan(cov_est)):
-            print(full_df)
+            logging.error("cov est has nan %s", cov_est)
             raise ValueError("something wrong with cov")
 
         num_nodes = len(prior_nodes) + 1
@@ -113,25 +217,15 @@ class AUCHypothesisTester(HypothesisTester):
         num_particles =  np.sum(1/(alpha * node_weights))
         alpha_spend = alpha * node_weights[-1]
         test_stat = estimate
-        print("ALPHA SPEND", alpha_spend)
+        logging.debug("ALPHA SPEND %f", alpha_spend)
         if len(prior_nodes) == 0:
-            boundary = scipy.stats.norm.ppf(1 - alpha_spend, scale=np.sqrt(cov_est[0,0]))
+            boundary = ndtri(1 - alpha_spend) * np.sqrt(cov_est[0,0])
             #stat, pval = scipy.stats.ttest_1samp(node.obs.to_numpy().flatten(), popmean=null_constraint[0,1], alternative="greater")
             #logging.info("tstat %f pval %f alpha %f", stat, pval, alpha_spend)
         elif alpha_spend <= 0:
             boundary = np.inf
         else:
-            np.savetxt(self.scratch_file_cov, cov_est, delimiter=",")
-            np.savetxt(self.scratch_file_bounds, prior_bounds, delimiter=",")
-            rcmd = "Rscript R/pmvnorm.R %s %s %f %d" % (self.scratch_file_cov, self.scratch_file_bounds, np.log10(alpha_spend), True)
-            output = subprocess.check_output(
-                rcmd,
-                stderr=subprocess.STDOUT,
-                shell=True,
-                encoding='UTF-8'
-            )
-            boundary = float(output[4:])
-            logging.info(rcmd)
+            boundary = get_sequential_boundary(cov_est, prior_bounds, alpha_spend, alt_greater=True)
             logging.info("Test bound %f, est %f, log alpha %f", boundary, estimate, np.log10(alpha_spend))
 
         test_res = (test_stat - null_constraint[0,1]) > boundary
@@ -141,29 +235,31 @@ class AUCHypothesisTester(HypothesisTester):
         return test_res, boundaries
 
 class LogLikHypothesisTester(AUCHypothesisTester):
+    obs_names = ["log_lik_diff"]
+
+    def get_influence_func(self, mdl):
+        pred_y = get_pred_prob(mdl, self.test_dat.x)
+        loglik = get_log_lik(self.test_dat.y.flatten(), pred_y)
+        return loglik, loglik.mean()
+
     def _get_observations(self, orig_mdl, new_mdl):
-        orig_pred_y = orig_mdl.predict_proba(self.test_dat.x)[:,1]
-        new_pred_y = new_mdl.predict_proba(self.test_dat.x)[:,1]
-        test_y = self.test_dat.y.flatten()
-        new_loglik = get_log_lik(test_y, new_pred_y)
-        orig_loglik = get_log_lik(test_y, orig_pred_y)
+        orig_loglik, _ = self._get_orig_influence_func(orig_mdl)
+        new_loglik, _ = self.get_influence_func(new_mdl)
         log_lik_diff = new_loglik - orig_loglik
         logging.info("orig ll %f new ll %f diff %f", orig_loglik.mean(), new_loglik.mean(), new_loglik.mean() - orig_loglik.mean())
-        df = pd.DataFrame({
-            "log_lik_diff": log_lik_diff,
-            })
-
-        return df, orig_loglik, new_loglik
+        return log_lik_diff.reshape((-1, 1)), orig_loglik, new_loglik
 
 class CalibZHypothesisTester(AUCHypothesisTester):
     def get_influence_func(self, mdl):
-        pred_y = mdl.predict_proba(self.test_dat.x)[:,1:]
+        pred_y = get_pred_prob(mdl, self.test_dat.x).reshape((-1,1))
         test_y = self.test_dat.y
         inf_func = pred_y - test_y
 
         return inf_func, inf_func.mean(axis=0)
 
 class CalibZAUCHypothesisTester(AUCHypothesisTester):
+    obs_names = ["calib_ic", "auc_diff_ic"]
+
     def __init__(self):
         """
         """
@@ -172,6 +268,7 @@ class CalibZAUCHypothesisTester(AUCHypothesisTester):
 
     def set_test_dat(self, test_dat):
         self.test_dat = test_dat
+        self._cached_mdl = None
         self.auc_hypo_tester.set_test_dat(test_dat)
         self.calib_hypo_tester.set_test_dat(test_dat)
 
@@ -185,31 +282,18 @@ class CalibZAUCHypothesisTester(AUCHypothesisTester):
         return influence_func, estimate
 
     def _get_observations(self, orig_mdl, new_mdl):
-        orig_ic, orig_est = self.get_influence_func(orig_mdl)
+        orig_ic, orig_est = self._get_orig_influence_func(orig_mdl)
         new_ic, new_est = self.get_influence_func(new_mdl)
-        df = pd.DataFrame({
-                "calib_ic": new_ic[:,0],
-                "auc_diff_ic": new_ic[:,1] - orig_ic[:,1]
-                })
+        obs = np.column_stack([new_ic[:,0], new_ic[:,1] - orig_ic[:,1]])
 
-        return df, orig_est, new_est
+        return obs, orig_est, new_est
 
     def _get_boundary(self, prior_bounds, cov_est, alpha_spend: float, alt_greater: bool = False):
         if prior_bounds.size == 0:
-            boundary = scipy.stats.norm.ppf((1 - alpha_spend) if alt_greater else alpha_spend, scale=np.sqrt(cov_est[0,0]))
+            boundary = ndtri((1 - alpha_spend) if alt_greater else alpha_spend) * np.sqrt(cov_est[0,0])
         else:
-            np.savetxt(self.scratch_file_cov, cov_est, delimiter=",")
-            np.savetxt(self.scratch_file_bounds, prior_bounds, delimiter=",")
             #print("ALPHA", alpha_spend)
-            rcmd = "Rscript R/pmvnorm.R %s %s %f %d" % (self.scratch_file_cov, self.scratch_file_bounds, np.log10(alpha_spend), alt_greater)
-            output = subprocess.check_output(
-                rcmd,
-                stderr=subprocess.STDOUT,
-                shell=True,
-                encoding='UTF-8'
-            )
-            boundary = float(output[4:])
-            logging.info(rcmd)
+            boundary = get_sequential_boundary(cov_est, prior_bounds, alpha_spend, alt_greater=alt_greater)
             logging.info("Test bound %f, log alpha %f", boundary, np.log10(alpha_spend))
         return boundary
 
@@ -220,28 +304,25 @@ class CalibZAUCHypothesisTester(AUCHypothesisTester):
         """
         estimate = node.obs.to_numpy().mean(axis=0)
         logging.info("test set estimate %s", estimate)
-        print("ESTIMATE", node.obs, estimate)
+        logging.debug("ESTIMATE %s %s", node.obs, estimate)
 
-        full_df = pd.concat([prior_node.obs for prior_node in prior_nodes] + [node.obs], axis=1).to_numpy().T
-        print("FULL DF", full_df.shape)
-        cov_est = np.cov(full_df)/self.test_dat.size
-        if full_df.shape[0] == 1:
-            cov_est = np.array([[cov_est]])
+        cov_est = self._get_cov_est(prior_nodes, node)
+        logging.debug("COV EST %s", cov_est.shape)
         #logging.info("cov est %s", cov_est)
         if np.any(np.isnan(cov_est)):
-            print(full_df)
+            logging.error("cov est has nan %s", cov_est)
             raise ValueError("something wrong with cov")
 
         num_nodes = len(prior_nodes) + 1
         assert not np.any(np.isnan(cov_est))
         node_weights = np.array([prior_node.weight for prior_node in prior_nodes] + [node.weight])
         prior_bounds = np.array([prior_node.bounds for prior_node in prior_nodes]).reshape((-1,2))
-        print("PRIOR BOUNDS", prior_bounds.shape)
+        logging.debug("PRIOR BOUNDS %s", prior_bounds.shape)
 
         test_res = False
         num_particles =  np.sum(1/(alpha * node_weights))
         node_alpha_spend = alpha * node_weights[-1]
-        print("node_wei", node_weights, alpha)
+        logging.debug("node_wei %s %f", node_weights, alpha)
         calib_intercept_lower_bound = self._get_boundary(prior_bounds, cov_est[:-1,:-1], node_alpha_spend, alt_greater=True)
         calib_intercept_upper_bound = self._get_boundary(prior_bounds, cov_est[:-1,:-1], node_alpha_spend, alt_greater=False)
         prior_bounds = np.vstack([prior_bounds, [calib_intercept_upper_bound, calib_intercept_lower_bound]])
@@ -2,21 +2,16 @@
 # -*- coding: utf-8 -*-
 
 import sys, os
-import time
 import argparse
 import pickle
 import logging
-import progressbar
-from typing import List, Dict
 
 import numpy as np
 import pandas as pd
-import seaborn as sns
-from matplotlib import pyplot as plt
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import roc_auc_score, plot_roc_curve, roc_curve, log_loss
+from scipy.special import xlogy
 
 from dataset import *
+from hypothesis_tester import get_pred_prob
 
 
 def parse_args():
@@ -29,45 +24,74 @@ def parse_args():
     parser.add_argument("--mtp-mech-file", type=str, default="_output/mtp_mech.pkl")
     parser.add_argument("--model-file", type=str, default="_output/model.pkl")
     parser.add_argument("--out-csv", type=str, default="_output/res.csv")
-    parser.add_argument("--scratch-file", type=str, default="_output/scratch.txt")
     parser.add_argument("--log-file", type=str, default="_output/log.txt")
     parser.add_argument("--plot-file", type=str, default=None)
     args = parser.parse_args()
     return args
 
 
+def get_nll(test_y, pred_y):
+    """
+    @param test_y: (n, 1) array of binary outcomes
+    @param pred_y: (n, k) array of predicted probabilities, one column per model
+    @return array with the negative log likelihood of each model
+    """
+    pred_y = np.clip(pred_y, 1e-10, 1 - 1e-10)
+    return -np.mean(xlogy(test_y, pred_y) + xlogy(1 - test_y, 1 - pred_y), axis=0)
+
+def score_model(hypo_tester, mdl, test_x, test_y):
+    """
+    @return predicted probabilities and auc of this model on the test data
+    """
+    pred_prob = get_pred_prob(mdl, test_x)
+    return pred_prob, hypo_tester.get_auc(test_y, pred_prob)
+
 def get_deployed_scores(mtp_mech, test_hist, test_dat, max_iter):
     """
     @return Dataframe with auc and nll for the approved models for the given test data
     """
-    last_approve_time = 0
     test_y = test_dat.y.flatten()
-    scores = []
-    for approve_idx, (mdl, time_idx) in enumerate(
-        zip(test_hist.approved_mdls, test_hist.approval_times)
-    ):
-        pred_prob = mdl.predict_proba(test_dat.x)[:, 1].reshape((-1, 1))
-        auc = mtp_mech.hypo_tester.get_auc(test_dat.y, pred_prob)
-        nll = log_loss(test_dat.y, pred_prob)
-
-        # calibration
-        print("OUTCOME RATE", test_dat.y.mean())
-        calib_z = np.mean(test_dat.y - pred_prob)
-
-        next_approve_time = (
-            test_hist.approval_times[approve_idx + 1]
-            if test_hist.tot_approves > (approve_idx + 1)
-            else max_iter + 1
-        )
-        for idx in range(time_idx, next_approve_time):
-            scores.append({
-                "auc": auc,
-                "nll": nll,
-                "calib": calib_z,
-                "time": idx
-                })
-    scores = pd.DataFrame(scores)
-    return pd.melt(scores, id_vars=['time'], value_vars=[c for c in list(scores.columns) if c != "time"])
+    approval_times = np.asarray(test_hist.approval_times, dtype=int)
+    # Scored sequentially, the simulations already run many main.py processes in parallel
+    mdl_scores = [
+        score_model(mtp_mech.hypo_tester, mdl, test_dat.x, test_y)
+        for mdl in test_hist.approved_mdls
+    ]
+    pred_probs = np.column_stack([pred_prob for pred_prob, _ in mdl_scores])
+    aucs = np.array([auc for _, auc in mdl_scores])
+    nlls = get_nll(test_y.reshape((-1, 1)), pred_probs)
+
+    # calibration
+    logging.info("OUTCOME RATE %f", test_y.mean())
+    calib_zs = np.mean(test_y.reshape((-1, 1)) - pred_probs, axis=0)
+
+    # Each approved model stays deployed until the next approval
+    approve_gaps = np.diff(np.append(approval_times, max_iter + 1))
+    score_names = ["auc", "nll", "calib"]
+    times = np.arange(approval_times[0], max_iter + 1)
+    return pd.DataFrame({
+        "time": np.tile(times, len(score_names)),
+        "variable": np.repeat(score_names, times.size),
+        "value": np.repeat(
+            np.concatenate([aucs, nlls, calib_zs]),
+            np.tile(approve_gaps, len(score_names))),
+        })
+
+def get_approval_counts(approval_times, max_iter):
+    """
+    The original model counts as the first approval, so it is not counted
+    @return Dataframes with whether any modification was approved and the number approved by each time
+    """
+    times = np.arange(max_iter + 1)
+    num_approvals = np.searchsorted(np.asarray(approval_times), times, side="right") - 1
+    count_df = pd.DataFrame({"value": num_approvals, "time": times})
+    count_df["dataset"] = "test"
+    count_df["variable"] = "num_approvals"
+    # written as 0/1 so the value column stays numeric
+    approve_df = pd.DataFrame({"value": (num_approvals > 0).astype(float), "time": times})
+    approve_df["dataset"] = "test"
+    approve_df["variable"] = "did_approval"
+    return approve_df, count_df
 
 #def get_good_bad_approved(test_hist, test_dat, max_iter):
 #    """
@@ -113,15 +137,12 @@ def main():
 
     with open(args.data_file, "rb") as f:
         data = pickle.load(f)["full_dat"]
-    print("data done")
 
     with open(args.mtp_mech_file, "rb") as f:
         mtp_mech = pickle.load(f)
-        mtp_mech.hypo_tester.make_scratch(args.scratch_file)
 
     with open(args.model_file, "rb") as f:
         modeler = pickle.load(f)
-        modeler.hypo_tester.make_scratch(args.scratch_file)
 
     np.random.seed(args.seed)
 
@@ -134,7 +155,6 @@ def main():
         maxfev=args.max_iter,
         side_dat_stream=data.side_train_dat_stream
     )
-    print("APPROVAL", full_hist.approval_times)
     logging.info("APPROVAL %s", full_hist.approval_times)
 
     conclusions_hist = full_hist.get_perf_hist()
@@ -145,27 +165,15 @@ def main():
         test_res = get_deployed_scores(mtp_mech, full_hist, data.test_dat, args.max_iter)
         test_res["dataset"] = "test"
     #good_approvals, bad_approvals, prop_good_approvals = get_good_bad_approved(full_hist, data.test_dat, args.max_iter)
-    num_approvals = np.array(
-        [
-            np.sum(np.array(full_hist.approval_times) <= i) - 1
-            for i in range(args.max_iter + 1)
-        ]
-    )
 
     # Compile results
-    times = np.arange(args.max_iter + 1)
     #bad_df = pd.DataFrame({"value": bad_approvals, "time": times})
     #bad_df["dataset"] = "test"
     #bad_df["variable"] = "bad_approvals"
     #good_df = pd.DataFrame({"value": good_approvals, "time": times})
     #good_df["dataset"] = "test"
     #good_df["variable"] = "good_approvals"
-    count_df = pd.DataFrame({"value": num_approvals, "time": times})
-    count_df["dataset"] = "test"
-    count_df["variable"] = "num_approvals"
-    approve_df = pd.DataFrame({"value": num_approvals > 0, "time": times})
-    approve_df["dataset"] = "test"
-    approve_df["variable"] = "did_approval"
+    approve_df, count_df = get_approval_counts(full_hist.approval_times, args.max_iter)
     df = pd.concat(
             [reuse_res, approve_df, count_df, conclusions_hist]
             + ([test_res] if data.test_dat else []))
@@ -173,6 +181,9 @@ def main():
 
     # Plot
     if args.plot_file:
+        import seaborn as sns
+        from matplotlib import pyplot as plt
+
         #print(df)
         sns.set_context("paper", font_scale=2)
         rel_plt = sns.relplot(
@@ -186,9 +197,9 @@ def main():
         )
         rel_plt.fig.suptitle(mtp_mech.name)
         plt.savefig(args.plot_file)
-        print("Fig", args.plot_file)
+        logging.info("Fig %s", args.plot_file)
 
-    df.to_csv(args.out_csv, index=False)
+    df.to_csv(args.out_csv, index=False, chunksize=65536)
 
 
 if __name__ == "__main__":
@@ -1,46 +1,60 @@
 import logging
-from copy import deepcopy
-from typing import List
+from copy import copy, deepcopy
+from typing import List, Dict
 import numpy as np
 import pandas as pd
-import scipy.optimize
+from scipy.special import expit, ndtr, ndtri
 import sklearn.base
-from sklearn.linear_model import LogisticRegression, LogisticRegressionCV
+from sklearn.linear_model import LogisticRegression, LogisticRegressionCV, SGDClassifier
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.ensemble import GradientBoostingClassifier
+from sklearn.ensemble import GradientBoostingClassifier, HistGradientBoostingClassifier
 
 from custom_models import *
-from dataset import Dataset, DataGenerator
-from hypothesis_tester import get_log_lik
+from dataset import Dataset, DatasetBuffer, DataGenerator
+from hypothesis_tester import get_log_lik, get_pred_prob
+
+def snapshot_model(mdl):
+    """
+    Logistic models only need their fitted parameters copied, which avoids deep copying the whole estimator
+    @return a copy of the model that is unaffected by later changes to mdl
+    """
+    if isinstance(mdl, LogisticRegression):
+        mdl_copy = copy(mdl)
+        mdl_copy.coef_ = mdl.coef_.copy()
+        mdl_copy.intercept_ = mdl.intercept_.copy()
+        return mdl_copy
+    return deepcopy(mdl)
 
 class TestHistory:
     """
     Tracks the history of test results
     """
     def __init__(self, curr_mdl, res_detail):
+        curr_mdl = snapshot_model(curr_mdl)
         self.approval_times = [0]
-        self.approved_mdls = [deepcopy(curr_mdl)]
-        self.proposed_mdls = [deepcopy(curr_mdl)]
+        self.approved_mdls = [curr_mdl]
+        self.proposed_mdls = [curr_mdl]
         self.curr_time = 0
         self.batch_numbers = [0]
         self.did_approve = [True]
-        self.res_details = [res_detail]
+        self.res_details = {k: [v] for k, v in res_detail.items()}
 
-    def update(self, test_res: int, res_detail: pd.DataFrame, proposed_mdl, batch_number: int = None):
+    def update(self, test_res: int, res_detail: Dict, proposed_mdl, batch_number: int = None):
         """
         @param test_res: 1 if we rejected the null, 0 if we failed to reject null
-        @param res_detail: pd.DataFrame with one column for each performance measure that is being tracked
+        @param res_detail: dict with one value for each performance measure that is being tracked
         @param proposed_mdl: the model that was proposed (but maybe not approved)
         """
         self.curr_time += 1
-        proposed_mdl = deepcopy(proposed_mdl)
+        proposed_mdl = snapshot_model(proposed_mdl)
         self.did_approve.append(test_res)
         if test_res:
             self.approval_times.append(self.curr_time)
             self.approved_mdls.append(proposed_mdl)
 
         self.proposed_mdls.append(proposed_mdl)
-        self.res_details.append(res_detail)
+        for k, v in res_detail.items():
+            self.res_details[k].append(v)
         self.batch_numbers.append(batch_number)
 
     @property
@@ -48,12 +62,26 @@ class TestHistory:
         return len(self.approval_times)
 
     def get_perf_hist(self):
-        perf_hist = pd.concat(self.res_details).reset_index()
-        perf_hist["batch_number"] = np.array(self.batch_numbers)
-        col_names = list(perf_hist.columns)
-        value_vars = col_names[1:]
-        perf_hist["time"] = np.arange(len(self.res_details))
-        return pd.melt(perf_hist, id_vars=['time'], value_vars=value_vars)
+        """
+        @return long-form pd.DataFrame with columns time, variable, value
+        """
+        perf_cols = dict(self.res_details, batch_number=self.batch_numbers)
+        num_times = len(self.batch_numbers)
+        return pd.DataFrame({
+            "time": np.tile(np.arange(num_times), len(perf_cols)),
+            "variable": np.repeat(list(perf_cols.keys()), num_times),
+            "value": np.concatenate([np.asarray(vals, dtype=float) for vals in perf_cols.values()]),
+            })
+
+def get_test_power(mu, var, num_test: int, popmean, alpha: float):
+    """
+    Normal approximation to the power of a one-sided test that the mean is greater than popmean
+    @param mu: assumed mean of each observation
+    @param var: assumed variance of each observation
+    @return power of testing at level alpha with num_test observations
+    """
+    ncp = (mu - popmean) * np.sqrt(num_test / var)
+    return ndtr(ncp - ndtri(1 - alpha))
 
 def set_model(mdl, params):
     mdl.classes_ = np.array([0, 1])
@@ -67,6 +95,8 @@ class LockedModeler:
     def _init_modeler(self, model_type: str):
         if model_type == "Logistic":
             modeler = LogisticRegression(penalty="none", max_iter=10000)
+        elif model_type == "LogisticWarmStart":
+            modeler = LogisticRegression(penalty="none", max_iter=10000, warm_start=True)
         elif model_type == "LogisticEven":
             modeler = LogisticRegressionEven(penalty="none", max_iter=10000)
         elif model_type == "LogisticOdd":
@@ -77,10 +107,17 @@ class LockedModeler:
             modeler = LogisticRegressionCV(class_weight="balanced", penalty="l1", max_iter=10000, solver="liblinear", cv=3, n_jobs=2, Cs=5, scoring="roc_auc")
         elif model_type == "LogisticRidge":
             modeler = LogisticRegressionCV(class_weight="balanced", penalty="l2", max_iter=10000, solver="liblinear", cv=3)
+        elif model_type == "LogisticSGD":
+            # A different learner from Logistic, not a faster refit: it is trained online by partial_fit,
+            # taking one SGD pass over each new block of data with the default learning rate schedule
+            modeler = SGDClassifier(loss="log_loss", penalty=None, random_state=0)
         elif model_type == "RandomForest":
             modeler = RandomForestClassifier(n_estimators=n_estimators, min_samples_leaf=1, n_jobs=2)
         elif model_type == "GBT":
             modeler = GradientBoostingClassifier(loss="deviance", max_depth=1, n_estimators=100)
+        elif model_type == "HistGBT":
+            # Same boosted stumps as GBT, but fit on binned features
+            modeler = HistGradientBoostingClassifier(max_depth=1, max_iter=100, early_stopping=False)
         else:
             raise NotImplementedError("model type missing")
         return modeler
@@ -89,7 +126,7 @@ class LockedModeler:
         self.modeler = self._init_modeler(model_type)
 
     def predict_prob(self, x):
-        return self.modeler.predict_proba(x)[:, 1].reshape((-1, 1))
+        return get_pred_prob(self.modeler, x).reshape((-1, 1))
 
 class AdversaryLossModeler(LockedModeler):
     """
@@ -111,57 +148,70 @@ class AdversaryLossModeler(LockedModeler):
         self.ni_margin = ni_margin
 
     def _set_oracle_model(self, mdl):
-        mdl.coef_[:] = self.data_gen.beta.flatten()
-        mdl.intercept_[:] = 0
+        set_model(mdl, np.concatenate([[0], self.data_gen.beta.flatten()]))
 
     def simulate_approval_process(self, dat, mtp_mechanism, dat_stream=None, maxfev=10, side_dat_stream=None):
         """
         @param side_dat_stream: ignores this
         """
-        # Train a good initial model
-        self.modeler.fit(dat.x, dat.y.flatten())
+        # Start from the oracle model, the coefficients are set directly so there is nothing to fit
         self._set_oracle_model(self.modeler)
         orig_coefs = self.modeler.coef_[:]
 
         orig_mdl = sklearn.base.clone(self.modeler)
-        orig_mdl.fit(dat.x, dat.y.flatten())
         self._set_oracle_model(orig_mdl)
 
         # Also have some predefined perturber for reference
         # just so we can use the parallel procedure
         self.predef_modeler = sklearn.base.clone(self.modeler)
-        self.predef_modeler.fit(dat.x, dat.y.flatten())
         self._set_oracle_model(self.predef_modeler)
 
         # Now search in each direction and do a greedy search
         curr_diff = 0
-        test_hist = TestHistory(self.modeler, res_detail=pd.DataFrame({
-                "curr_diff": [curr_diff],
-                }))
+        test_hist = TestHistory(self.modeler, res_detail={"curr_diff": curr_diff})
+        num_dirs = len(self.update_dirs)
+        # Modifications are made in place to curr_coef and undone if they are not approved
+        curr_coef = np.concatenate(
+            [self.modeler.intercept_, self.modeler.coef_[0]]
+        )
+        # Reused for every proposal, each proposal gets its own copy of curr_coef so it does not alias the buffer
+        proposed_mdl = sklearn.base.clone(self.modeler)
+        # If a perturbation changes no predicted probability on the training data by more than this,
+        # the sigmoid is saturated and it is not worth testing
+        saturation_tol = 1e-6
+        # Logits of the current model on the training data, a perturbation only shifts them along one column
+        curr_logit = curr_coef[0] + dat.x @ curr_coef[1:]
+        curr_pred_prob = expit(curr_logit)
         while test_hist.curr_time < maxfev:
+            sweep_start_time = test_hist.curr_time
             # Test each coef (dont perturb intercept)
-            for var_idx in range(self.num_sparse_theta + 1, self.num_sparse_theta + 1 + dat.x.shape[1]):
+            for var_idx in range(self.num_sparse_theta + 1, dat.x.shape[1] + 1):
                 # Test update for the variable
                 for update_dir in self.update_dirs:
                     test_res = 1
                     scale_factor = 1
+                    is_saturated = False
                     while test_res == 1:
                         if test_hist.curr_time >= maxfev:
                             break
                         # Generate adaptive modification
-                        curr_coef = np.concatenate(
-                            [self.modeler.intercept_, self.modeler.coef_.flatten()]
-                        )
-                        print("var idx", var_idx)
-                        curr_coef[var_idx] += update_dir * self.update_incr * scale_factor
+                        logging.debug("var idx %d", var_idx)
+                        prev_coef_val = curr_coef[var_idx]
+                        coef_incr = update_dir * self.update_incr * scale_factor
+                        proposed_logit = curr_logit + coef_incr * dat.x[:, var_idx - 1]
+                        proposed_pred_prob = expit(proposed_logit)
+                        is_saturated = np.max(np.abs(proposed_pred_prob - curr_pred_prob)) < saturation_tol
+                        if is_saturated:
+                            logging.info("stop perturbing var %d, predictions are saturated", var_idx)
+                            break
+                        curr_coef[var_idx] += coef_incr
                         logging.info("CURR_COEF %s", curr_coef)
-                        proposed_mdl = sklearn.base.clone(self.modeler)
-                        set_model(proposed_mdl, curr_coef)
+                        set_model(proposed_mdl, curr_coef.copy())
 
                         # Generate predefined model
                         self.predef_modeler.coef_[0, :] = orig_coefs
-                        predef_coef_idx = self.num_sparse_theta + (test_hist.curr_time // len(self.update_dirs))
-                        predef_update_dir = test_hist.curr_time % len(self.update_dirs)
+                        predef_coef_idx = self.num_sparse_theta + (test_hist.curr_time // num_dirs)
+                        predef_update_dir = test_hist.curr_time % num_dirs
                         self.predef_modeler.coef_[0, predef_coef_idx] += (
                             self.update_dirs[predef_update_dir] * self.update_incr
                         )
@@ -172,11 +222,12 @@ class AdversaryLossModeler(LockedModeler):
                         test_res = mtp_mechanism.get_test_res(
                             null_constraints, orig_mdl, proposed_mdl, orig_predef_mdl=orig_mdl, predef_mdl=self.predef_modeler
                         )
-                        print("perturb?", test_hist.curr_time, var_idx, update_dir, test_res)
+                        logging.debug("perturb? %d %d %d %d", test_hist.curr_time, var_idx, update_dir, test_res)
                         if test_res:
-                            print("TEST RES")
+                            logging.debug("TEST RES")
                             curr_diff += self.ni_margin
-                            set_model(self.modeler, curr_coef)
+                            set_model(self.modeler, curr_coef.copy())
+                            curr_logit, curr_pred_prob = proposed_logit, proposed_pred_prob
                             logging.info("APPROVED %s", curr_coef)
                             # If we found a good direction, keep walking in that direction,
                             # be twice as aggressive
@@ -184,14 +235,18 @@ class AdversaryLossModeler(LockedModeler):
 
                         test_hist.update(
                             test_res=test_res,
-                            res_detail=pd.DataFrame({
-                                "curr_diff": [curr_diff],
-                                }),
+                            res_detail={"curr_diff": curr_diff},
                             proposed_mdl=proposed_mdl,
                             batch_number=test_hist.curr_time,
                         )
-                    if test_res == 0 and scale_factor > 1:
+                        if not test_res:
+                            curr_coef[var_idx] = prev_coef_val
+                    if (test_res == 0 or is_saturated) and scale_factor > 1:
                         break
+            if test_hist.curr_time == sweep_start_time:
+                # every perturbation was skipped, so another sweep would not test anything either
+                logging.info("stop: no perturbation changes the predictions")
+                break
 
         return test_hist
 
@@ -213,6 +268,7 @@ class OnlineAdaptLossModeler(LockedModeler):
         self.power = power
         self.predef_alpha = predef_alpha
         self.se_factor = se_factor
+        self._obs_cache = {}
 
     def _create_train_valid_dat(self, dat: Dataset):
         valid_n = max(self.min_valid_dat_size, int(dat.size * self.validation_frac))
@@ -221,43 +277,75 @@ class OnlineAdaptLossModeler(LockedModeler):
         valid_dat = dat.subset(start_n=dat.size - valid_n, n=dat.size)
         return train_dat, valid_dat
 
-    def _do_power_calc_test_bound(self, orig_mdl, new_mdl, min_diff:float, valid_dat: Dataset, alpha: float, num_test: int, num_reps: int = 100):
+    def _refit_model(self, prev_mdl, template_mdl, train_dat: Dataset, prev_train_n: int):
+        """
+        Models that support partial_fit are online learners: they take one pass over the training rows added
+        since the last fit, so the result differs from refitting on all of train_dat.
+        Warm-started models are refit on all of train_dat, starting from the previous solution.
+        @param prev_mdl: model from the previous iteration (not modified)
+        @param template_mdl: model to clone if we need to fit from scratch
+        @param prev_train_n: number of leading rows in train_dat that prev_mdl was trained on
+        @return model fit on train_dat
+        """
+        if prev_mdl is not None and hasattr(prev_mdl, "partial_fit"):
+            mdl = deepcopy(prev_mdl)
+            new_train_dat = train_dat.subset(train_dat.size, start_n=prev_train_n)
+            if new_train_dat.size > 0:
+                mdl.partial_fit(new_train_dat.x, new_train_dat.y.flatten(), classes=np.array([0, 1]))
+        elif prev_mdl is not None and getattr(prev_mdl, "warm_start", False):
+            mdl = snapshot_model(prev_mdl)
+            mdl.fit(train_dat.x, train_dat.y.flatten())
+        else:
+            mdl = sklearn.base.clone(template_mdl)
+            mdl.fit(train_dat.x, train_dat.y.flatten())
+        return mdl
+
+    def _get_valid_observations(self, orig_mdl, new_mdl, valid_dat: Dataset, max_cache_size: int = 4):
+        """
+        The predef and adaptive power calcs evaluate the same pair of models on the same validation data,
+        so the observations are memoized by object identity
+        @return observations as a numpy array, orig estimate, new estimate
+        """
+        cache_key = (id(orig_mdl), id(new_mdl), id(valid_dat))
+        if cache_key in self._obs_cache:
+            return self._obs_cache[cache_key][1]
+
+        self.hypo_tester.set_test_dat(valid_dat)
+        res = self.hypo_tester._get_observations(orig_mdl, new_mdl)
+        if len(self._obs_cache) >= max_cache_size:
+            self._obs_cache.pop(next(iter(self._obs_cache)))
+        # keep references to the keyed objects so their ids are not reused while cached
+        self._obs_cache[cache_key] = ((orig_mdl, new_mdl, valid_dat), res)
+        return res
+
+    def _do_power_calc_test_bound(self, orig_mdl, new_mdl, min_diff:float, valid_dat: Dataset, alpha: float, num_test: int):
         """
         @param valid_dat: data for evaluating performance of model
         @param alpha: the type I error of the current test node
         """
         logging.info("predef alpha %f", alpha)
         # use valid_dat to evaluate the model first
-        self.hypo_tester.set_test_dat(valid_dat)
-        res_df, orig_auc, new_auc = self.hypo_tester._get_observations(orig_mdl, new_mdl)
-        res_df = res_df.to_numpy().flatten()
+        obs, orig_auc, new_auc = self._get_valid_observations(orig_mdl, new_mdl, valid_dat)
+        obs = obs[:, 0]
         logging.info("validation: new old %f auc %f", orig_auc, new_auc)
-        mu_sim_raw = np.mean(res_df)
-        var_sim = np.var(res_df)
+        mu_sim_raw = np.mean(obs)
+        var_sim = np.var(obs)
         mu_sim = mu_sim_raw - np.sqrt(var_sim/valid_dat.size) * self.se_factor
         logging.info("power calc: MU SIM lower %s", mu_sim_raw)
 
         if mu_sim < 0:
             return 0, mu_sim
 
-        candidate_diffs = np.arange(min_diff, mu_sim, self.ni_margin)[:1]
-        if candidate_diffs.size == 0:
+        # Only the smallest candidate difference, min_diff, is ever tested
+        if mu_sim <= min_diff:
             logging.info("abort: no candidates found %f %f", min_diff, mu_sim)
             return 0, mu_sim
 
-        obs_sim = np.random.normal(loc=mu_sim, scale=np.sqrt(var_sim), size=(num_test, num_reps))
-        res = scipy.stats.ttest_1samp(obs_sim, popmean=candidate_diffs.reshape((-1,1)))
-        candidate_power = np.mean(res.statistic > scipy.stats.norm.ppf(1 - alpha), axis=1)
-
-        if np.any(candidate_power > self.power):
-            selected_idx = np.max(np.where(candidate_power > self.power)[0])
-        else:
+        test_power = get_test_power(mu_sim, var_sim, num_test, min_diff, alpha)
+        if test_power <= self.power:
             logging.info("abort: power too low")
-            selected_idx = np.argmax(candidate_power)
 
-        selected_thres = candidate_diffs[selected_idx]
-        test_power = candidate_power[selected_idx]
-        return test_power, selected_thres
+        return test_power, min_diff
 
 
     def simulate_approval_process(self, dat, mtp_mechanism, dat_stream, maxfev=10, side_dat_stream = None):
@@ -265,26 +353,29 @@ class OnlineAdaptLossModeler(LockedModeler):
         @param dat_stream: a list of datasets for further training the model
         @return perf_value
         """
+        self._obs_cache = {}
         train_dat, valid_dat = self._create_train_valid_dat(dat)
         self.prespec_modeler.fit(train_dat.x, train_dat.y.flatten())
         orig_mdl = self.prespec_modeler
 
         curr_diff= 0
-        test_hist = TestHistory(orig_mdl, res_detail=pd.DataFrame({
-                "curr_diff": [0],
-                }))
+        test_hist = TestHistory(orig_mdl, res_detail={"curr_diff": 0})
         test_idx = 0
         adapt_read_idx = 0
         predef_test_mdls = []
+        predef_dat_buffer = DatasetBuffer(dat, dat_stream)
+        predef_lr = orig_mdl
+        online_mdl = None
+        prev_train_n = train_dat.size
         while (test_idx < maxfev) and (adapt_read_idx < len(dat_stream)):
-            print("ITERATION", test_idx)
+            logging.debug("ITERATION %d", test_idx)
 
-            predef_dat = Dataset.merge([dat] + dat_stream[: adapt_read_idx + 1])
-            predef_train_dat, predef_valid_dat = self._create_train_valid_dat(predef_dat)
-            predef_lr = sklearn.base.clone(self.prespec_modeler)
-            predef_lr.fit(predef_train_dat.x, predef_train_dat.y.flatten())
-            online_mdl = sklearn.base.clone(self.modeler)
-            online_mdl.fit(predef_train_dat.x, predef_train_dat.y.flatten())
+            predef_dat_buffer.append(dat_stream[adapt_read_idx])
+            predef_train_dat, predef_valid_dat = self._create_train_valid_dat(predef_dat_buffer.dataset)
+            # fit sequentially so that models drawing from the global RNG stay reproducible under a fixed seed
+            predef_lr = self._refit_model(predef_lr, self.prespec_modeler, predef_train_dat, prev_train_n)
+            online_mdl = self._refit_model(online_mdl, self.modeler, predef_train_dat, prev_train_n)
+            prev_train_n = predef_train_dat.size
 
             # calculate the threshold that we can test at such that the power of rejecting the null given Type I error at level alpha_node
             predef_test_power, _ = self._do_power_calc_test_bound(
@@ -332,19 +423,16 @@ class OnlineAdaptLossModeler(LockedModeler):
                     curr_diff = adapt_test_diff
                 test_idx += 1
                 logging.info("Test res %d", test_res)
-                print("TEST RES", test_res)
 
                 test_hist.update(
                         test_res=test_res,
-                        res_detail = pd.DataFrame({
-                            "curr_diff": [curr_diff]}),
+                        res_detail={"curr_diff": curr_diff},
                         proposed_mdl=online_mdl,
                         batch_number=adapt_read_idx,
                     )
             else:
                 logging.info("CONTinuing to pull data until confident in improvement %f <  %f + %f", adapt_test_diff, curr_diff, self.ni_margin)
         logging.info("adapt read idx %d", adapt_read_idx)
-        print("adapt read", adapt_read_idx)
         logging.info("TEST batch numbers %s (len %d)", test_hist.batch_numbers, len(test_hist.batch_numbers))
 
         return test_hist
@@ -364,45 +452,39 @@ class OnlineAdaptCalibAUCModeler(OnlineAdaptLossModeler):
         self.power = power
         self.predef_alpha = predef_alpha
         self.se_factor = se_factor
-
-    def _do_calib_power_test(self, calib_mu_lower, calib_mu_upper, calib_var, alpha, num_test, num_reps):
-        # Test calib lower
-        calib_obs_sim = np.random.normal(
-                loc=calib_mu_lower,
-                scale=np.sqrt(calib_var), size=(num_test, num_reps))
-        res = scipy.stats.ttest_1samp(calib_obs_sim, popmean=self.calib_bounds[0])
-        candidate_power = np.mean(res.statistic > scipy.stats.norm.ppf(1 - alpha))
-
-        if candidate_power < self.power:
-            logging.info("abort calibration lower %f (bound %f)", candidate_power, self.calib_bounds[0])
+        self._obs_cache = {}
+
+    def _do_calib_power_test(self, calib_mu_lower, calib_mu_upper, calib_var, alpha, num_test):
+        # Power of testing calib lower (greater than) and calib upper (less than) at once,
+        # the upper test is a greater than test after flipping signs
+        lower_power, upper_power = get_test_power(
+                np.array([calib_mu_lower, -calib_mu_upper]),
+                calib_var,
+                num_test,
+                np.array([self.calib_bounds[0], -self.calib_bounds[1]]),
+                alpha)
+
+        if lower_power < self.power:
+            logging.info("abort calibration lower %f (bound %f)", lower_power, self.calib_bounds[0])
             return False
-
-        # Test calib upper
-        calib_obs_sim = np.random.normal(
-                loc=calib_mu_upper,
-                scale=np.sqrt(calib_var), size=(num_test, num_reps))
-        res = scipy.stats.ttest_1samp(calib_obs_sim, popmean=self.calib_bounds[1])
-        candidate_power = np.mean(res.statistic < scipy.stats.norm.ppf(alpha))
-        if candidate_power < self.power:
-            logging.info("abort calibration upper %f", candidate_power)
+        if upper_power < self.power:
+            logging.info("abort calibration upper %f", upper_power)
             return False
         return True
 
-    def _do_power_calc_test_bound(self, orig_mdl, new_mdl, min_diff:float, valid_dat: Dataset, alpha: float, num_test: int, num_reps: int = 200):
+    def _do_power_calc_test_bound(self, orig_mdl, new_mdl, min_diff:float, valid_dat: Dataset, alpha: float, num_test: int):
         """
         @param valid_dat: data for evaluating performance of model
         @param alpha: the type I error of the current test node
         """
         logging.info("predef alpha %f", alpha)
         # use valid_dat to evaluate the model first
-        self.hypo_tester.set_test_dat(valid_dat)
-        res_df, orig_est, new_est = self.hypo_tester._get_observations(orig_mdl, new_mdl)
-        res_df = res_df.to_numpy()
+        obs, orig_est, new_est = self._get_valid_observations(orig_mdl, new_mdl, valid_dat)
 
         # Get performance characteristics
-        mu_sim_raw = np.mean(res_df, axis=0)
-        calib_var = np.var(res_df[:,0])
-        auc_var = np.var(res_df[:,1])
+        mu_sim_raw = np.mean(obs, axis=0)
+        calib_var = np.var(obs[:,0])
+        auc_var = np.var(obs[:,1])
 
         # Run simulation with these assumed performance characteristics (using CI lower bound)
         auc_sim = mu_sim_raw[1] - np.sqrt(auc_var/valid_dat.size) * self.se_factor
@@ -413,7 +495,7 @@ class OnlineAdaptCalibAUCModeler(OnlineAdaptLossModeler):
         logging.info("power sim mu: %f %f %f", auc_sim, calib_lower, calib_upper)
         logging.info("validation var calbi %f auc %f", calib_var/valid_dat.size, auc_var/valid_dat.size)
 
-        is_calib_good = self._do_calib_power_test(calib_lower, calib_upper, calib_var, alpha, num_test, num_reps)
+        is_calib_good = self._do_calib_power_test(calib_lower, calib_upper, calib_var, alpha, num_test)
         if not is_calib_good:
             logging.info("abort calib-in-the-larg")
             return 0, auc_sim
@@ -424,24 +506,16 @@ class OnlineAdaptCalibAUCModeler(OnlineAdaptLossModeler):
         if (auc_sim < 0) or not np.isfinite(auc_sim):
             return 0, auc_sim
 
-        candidate_diffs = np.arange(min_diff, auc_sim, self.ni_margin)[:1]
-        if candidate_diffs.size == 0:
+        # Only the smallest candidate difference, min_diff, is ever tested
+        if auc_sim <= min_diff:
             logging.info("abort: no candidates found %f %f", min_diff, auc_sim)
             return 0, auc_sim
 
-        obs_sim = np.random.normal(loc=auc_sim, scale=np.sqrt(auc_var), size=(num_test, num_reps))
-        res = scipy.stats.ttest_1samp(obs_sim, popmean=candidate_diffs.reshape((-1,1)))
-        candidate_power = np.mean(res.statistic > scipy.stats.norm.ppf(1 - alpha), axis=1)
-
-        if np.any(candidate_power > self.power):
-            selected_idx = np.max(np.where(candidate_power > self.power)[0])
-        else:
+        test_power = get_test_power(auc_sim, auc_var, num_test, min_diff, alpha)
+        if test_power <= self.power:
             logging.info("abort: power too low")
-            selected_idx = np.argmax(candidate_power)
 
-        selected_thres = candidate_diffs[selected_idx]
-        test_power = candidate_power[selected_idx]
-        return test_power, selected_thres
+        return test_power, min_diff
 
 
     def simulate_approval_process(self, dat, mtp_mechanism, dat_stream, maxfev=10, side_dat_stream = None):
@@ -449,25 +523,27 @@ class OnlineAdaptCalibAUCModeler(OnlineAdaptLossModeler):
         @param dat_stream: a list of datasets for further training the model
         @return perf_value
         """
+        self._obs_cache = {}
         train_dat, valid_dat = self._create_train_valid_dat(dat)
         self.modeler.fit(train_dat.x, train_dat.y.flatten())
         orig_mdl = self.modeler
 
         curr_diff= 0
-        test_hist = TestHistory(orig_mdl, res_detail=pd.DataFrame({
-                "curr_diff": [0],
-                }))
+        test_hist = TestHistory(orig_mdl, res_detail={"curr_diff": 0})
         test_idx = 0
         adapt_read_idx = 0
         predef_test_mdls = []
+        predef_dat_buffer = DatasetBuffer(dat, dat_stream)
+        predef_lr = orig_mdl
+        prev_train_n = train_dat.size
         while (test_idx < maxfev) and (adapt_read_idx < len(dat_stream)):
             logging.info("ITERATION %d %d", test_idx, adapt_read_idx)
 
-            predef_dat = Dataset.merge([dat] + dat_stream[: adapt_read_idx + 1])
-            predef_train_dat, predef_valid_dat = self._create_train_valid_dat(predef_dat)
+            predef_dat_buffer.append(dat_stream[adapt_read_idx])
+            predef_train_dat, predef_valid_dat = self._create_train_valid_dat(predef_dat_buffer.dataset)
             logging.info("TRAIN SIZE %d", predef_train_dat.size)
-            predef_lr = sklearn.base.clone(self.modeler)
-            predef_lr.fit(predef_train_dat.x, predef_train_dat.y.flatten())
+            predef_lr = self._refit_model(predef_lr, self.modeler, predef_train_dat, prev_train_n)
+            prev_train_n = predef_train_dat.size
 
             # calculate the threshold that we can test at such that the power of rejecting the null given Type I error at level alpha_node
             predef_test_power, _ = self._do_power_calc_test_bound(
@@ -512,19 +588,16 @@ class OnlineAdaptCalibAUCModeler(OnlineAdaptLossModeler):
                     curr_diff = adapt_test_diff
                 test_idx += 1
                 logging.info("Test res %d", test_res)
-                print("TEST RES", test_res)
 
                 test_hist.update(
                         test_res=test_res,
-                        res_detail = pd.DataFrame({
-                            "curr_diff": [curr_diff]}),
+                        res_detail={"curr_diff": curr_diff},
                         proposed_mdl=predef_lr,
                         batch_number=adapt_read_idx,
                     )
             else:
                 logging.info("CONTinuing to pull data until confident in improvement %f <  %f + %f", adapt_test_diff, curr_diff, self.ni_margin)
         logging.info("adapt read idx %d", adapt_read_idx)
-        print("adapt read", adapt_read_idx)
         logging.info("TEST batch numbers %s (len %d)", test_hist.batch_numbers, len(test_hist.batch_numbers))
 
         return test_hist
@@ -54,13 +54,13 @@ class BinaryThresholdMTP:
             return
 
         if test_result == 1:
-            print("**EARN weights", self.test_tree.weight)
+            logging.debug("**EARN weights %s", self.test_tree.weight)
             for child, cweight in zip(self.test_tree.children, self.test_tree.children_weights):
                 child.weight += cweight * self.test_tree.weight
             self.parent_child_idx = 0
             self.test_tree = self.test_tree.children[self.parent_child_idx]
         else:
-            print("**FAIL, parent", self.test_tree.parent)
+            logging.debug("**FAIL, parent %s", self.test_tree.parent)
             self.parent_child_idx += 1
             self.test_tree = self.test_tree.parent.children[self.parent_child_idx]
         self._create_children(self.test_tree, self.num_queries)
@@ -170,7 +170,6 @@ class GraphicalBonfMTP(BinaryThresholdMTP):
         alpha,
         success_weight,
         alpha_alloc_max_depth: int = 0,
-        scratch_file: str = None,
     ):
         self.hypo_tester = hypo_tester
         self.alpha = alpha
@@ -178,7 +177,6 @@ class GraphicalBonfMTP(BinaryThresholdMTP):
         assert alpha_alloc_max_depth == 0
         self.alpha_alloc_max_depth = alpha_alloc_max_depth
         self.parallel_ratio = 0
-        self.scratch_file = scratch_file
 
     def _create_children(self, node, query_idx):
         """
@@ -191,10 +189,8 @@ class GraphicalBonfMTP(BinaryThresholdMTP):
             parent=node,
             ) for i in range(self.num_adapt_queries - query_idx - 1)]
         node.children = children
-        node.children_weights = []
-        for i in range(0, self.num_adapt_queries - query_idx - 1):
-            spent_weight = sum(node.children_weights)
-            node.children_weights.append((1 - spent_weight) * self.success_weight)
+        # each child gets success_weight of the weight not yet spent on earlier children
+        node.children_weights = list(self._children_weights[:len(children)])
         if children:
             node.children_weights[-1] = 1 - np.sum(node.children_weights[:-1])
 
@@ -203,6 +199,7 @@ class GraphicalBonfMTP(BinaryThresholdMTP):
 
         self.num_queries = -1
         self.num_adapt_queries = num_adapt_queries
+        self._children_weights = self.success_weight * np.power(1 - self.success_weight, np.arange(num_adapt_queries))
 
         self.start_node = Node(
             1,
@@ -262,7 +259,6 @@ class GraphicalParallelMTP(GraphicalFFSMTP):
         parallel_ratio: float = 0.9,
         first_pres_weight: float = 0.5,
         alpha_alloc_max_depth: int = 0,
-        scratch_file: str = None,
     ):
         self.hypo_tester = hypo_tester
         self.alpha = alpha
@@ -270,31 +266,22 @@ class GraphicalParallelMTP(GraphicalFFSMTP):
         self.parallel_ratio = parallel_ratio
         self.first_pres_weight = first_pres_weight
         self.alpha_alloc_max_depth = alpha_alloc_max_depth
-        self.scratch_file = scratch_file
 
     def init_test_dat(self, test_dat, num_adapt_queries):
         self.hypo_tester.set_test_dat(test_dat)
 
         self.num_queries = -1
         self.num_adapt_queries = num_adapt_queries
+        self._children_weights = self.success_weight * np.power(1 - self.success_weight, np.arange(num_adapt_queries))
 
         # Create parallel sequence
-        self.parallel_tree_nodes = []
-        self.parallel_tree_nodes.append(Node(
-            self.first_pres_weight * self.parallel_ratio,
-            history=[],
-        ))
-        for i in range(1, num_adapt_queries + 1):
-            weight = (
-                (1 - self.first_pres_weight)/num_adapt_queries * self.parallel_ratio
-                if i < num_adapt_queries
-                else 0
-                )
-            self.parallel_tree_nodes.append(Node(
-                weight,
-                history=[None] * i,
-                parent=None
-            ))
+        parallel_weights = np.full(num_adapt_queries + 1, (1 - self.first_pres_weight)/max(num_adapt_queries, 1) * self.parallel_ratio)
+        parallel_weights[-1] = 0
+        parallel_weights[0] = self.first_pres_weight * self.parallel_ratio
+        self.parallel_tree_nodes = [
+            Node(weight, history=[None] * i, parent=None)
+            for i, weight in enumerate(parallel_weights)
+        ]
 
         # Create adapt tree
         self.start_node = Node(
@@ -317,14 +304,14 @@ class GraphicalParallelMTP(GraphicalFFSMTP):
             return
 
         if adapt_tree_res == 1:
-            print("EARN weights")
+            logging.debug("EARN weights")
             for child, cweight in zip(self.test_tree.children, self.test_tree.children_weights):
                 child.weight += cweight * self.test_tree.weight
             self.parent_child_idx = 0
             self.test_tree = self.test_tree.children[self.parent_child_idx]
         else:
             self.parent_child_idx += 1
-            print("num childs", len(self.test_tree.parent.children), self.parent_child_idx)
+            logging.debug("num childs %d %d", len(self.test_tree.parent.children), self.parent_child_idx)
             self.test_tree = self.test_tree.parent.children[self.parent_child_idx]
         self._create_children(self.test_tree, self.num_queries)
         self.test_tree.local_alpha = self.alpha * self.test_tree.weight
@@ -342,7 +329,7 @@ class GraphicalParallelMTP(GraphicalFFSMTP):
         node_obs = self.hypo_tester.get_observations(orig_mdl, new_mdl)
         self.test_tree.store_observations(node_obs)
         prior_nodes = self.parallel_tree_nodes[:(self.num_queries + 1)]
-        print("HIST", self.test_tree.history)
+        logging.debug("HIST %s", self.test_tree.history)
         test_res, node_bounds = self.hypo_tester.test_null(self.alpha, self.test_tree, null_hypo, prior_nodes=prior_nodes)
         self.test_tree.bounds = node_bounds
 
@@ -16,3 +16,25 @@ class Node:
 
     def store_observations(self, obs: np.ndarray):
         self.obs = obs
+        self._centered_obs = None
+        self._cross_cov = {}
+
+    def get_centered_obs(self):
+        if self._centered_obs is None:
+            obs = np.asarray(self.obs, dtype=float)
+            self._centered_obs = obs - obs.mean(axis=0)
+        return self._centered_obs
+
+    def get_cross_cov(self, other):
+        """
+        Prior nodes are compared against every later node, so the sample cross-covariance
+        with each other node is cached until new observations are stored
+        @return matrix with the covariance between each column of self.obs and each column of other.obs
+        """
+        cached = self._cross_cov.get(other)
+        if cached is None or cached[0] is not other.obs:
+            self_obs = self.get_centered_obs()
+            cross_cov = self_obs.T @ other.get_centered_obs() / (self_obs.shape[0] - 1)
+            cached = (other.obs, cross_cov)
+            self._cross_cov[other] = cached
+        return cached[1]
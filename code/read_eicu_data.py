@@ -26,21 +26,23 @@ def parse_args():
     args = parser.parse_args()
     return args
 
-def _get_data(full_dat, patient_stay_ids, selected_ids, max_random_pick=None):
+def _get_data(full_dat, patient_row_idxs, selected_ids, max_random_pick=None):
+    """
+    @param patient_row_idxs: dict mapping each patient id to its row indices in full_dat
+    """
     if max_random_pick is not None:
-        selected_rows = []
+        selected_row_idxs = []
         for p_stay_id in selected_ids:
-            stay_row_idxs = np.where(patient_stay_ids == p_stay_id)[0]
+            stay_row_idxs = patient_row_idxs[p_stay_id]
             if max_random_pick > stay_row_idxs.size:
                 selected_idxs = stay_row_idxs
             else:
                 selected_idxs = np.random.choice(stay_row_idxs, size=max_random_pick, replace=False)
-            selected_rows.append(full_dat[selected_idxs])
-        return np.concatenate(selected_rows)
+            selected_row_idxs.append(selected_idxs)
     else:
-        return np.concatenate([
-            full_dat[patient_stay_ids == p_stay_id] for p_stay_id in selected_ids
-            ])
+        selected_row_idxs = [patient_row_idxs[p_stay_id] for p_stay_id in selected_ids]
+    # gather all the selected rows at once, so each row is only copied once
+    return full_dat[np.concatenate(selected_row_idxs)]
 
 def main():
     args = parse_args()
@@ -56,16 +58,19 @@ def main():
     window_offsets = dat[:,1]
     dat = dat[:,2:]
 
+    # Row indices of each patient, so selecting a patient does not scan all the rows
+    patient_row_idxs = pd.Series(np.arange(patient_stay_ids.size)).groupby(patient_stay_ids).indices
+
     # Shuffle patient ids
     num_uniq_ids = np.unique(patient_stay_ids).size
     logging.info("uniq patient ids %d, train %d", num_uniq_ids, args.init_train_n)
     rand_ids = np.random.choice(np.unique(patient_stay_ids), num_uniq_ids, replace=False)
     print("RAND", rand_ids, num_uniq_ids)
     init_train_idxs = rand_ids[:args.init_train_n]
-    init_train_dat = _get_data(dat, patient_stay_ids, init_train_idxs, max_random_pick=args.random_pick_n)
+    init_train_dat = _get_data(dat, patient_row_idxs, init_train_idxs, max_random_pick=args.random_pick_n)
     start_idx = args.init_train_n
     reuse_test_idxs = rand_ids[start_idx: start_idx + args.reuse_test_n]
-    reuse_test_dat = _get_data(dat, patient_stay_ids, reuse_test_idxs, max_random_pick=args.random_pick_n)
+    reuse_test_dat = _get_data(dat, patient_row_idxs, reuse_test_idxs, max_random_pick=args.random_pick_n)
     start_idx += args.reuse_test_n
     logging.info("num reuse %d", reuse_test_idxs.size)
     assert reuse_test_idxs.size == args.reuse_test_n
@@ -84,7 +89,7 @@ def main():
     for batch_start_idx in range(start_idx, rand_ids.size, args.train_batch_n):
         #batch_start_idx = start_idx + batch_idx * args.train_batch_n
         batch_ids = rand_ids[batch_start_idx: batch_start_idx + args.train_batch_n]
-        dat_slice = _get_data(dat, patient_stay_ids, batch_ids, max_random_pick=args.random_pick_n)
+        dat_slice = _get_data(dat, patient_row_idxs, batch_ids, max_random_pick=args.random_pick_n)
         iid_train_dats.append(
                 Dataset(
                     x=dat_slice[:,:-1],
@@ -105,6 +110,7 @@ def main():
                 "full_dat": full_dat,
             },
             f,
+            protocol=pickle.HIGHEST_PROTOCOL,
         )
 
 
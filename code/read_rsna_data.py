@@ -28,22 +28,39 @@ def parse_args():
     args.dat_files = args.dat_files.split(",")
     return args
 
-def _get_data(full_dat, patient_ids, selected_ids, max_random_pick=None):
+def _read_dat_file(dat_file: str):
+    """
+    Only parses the patient ids, the outcome (column 4), and the features (columns 12 onwards)
+    @return patient ids, numpy array with the outcome in the first column followed by the features
+    """
+    col_names = pd.read_csv(dat_file, delimiter=",", nrows=0).columns
+    dat_cols = col_names[np.concatenate([[4], np.arange(12, col_names.size)])]
+    file_dat = pd.read_csv(
+        dat_file,
+        delimiter=",",
+        usecols=lambda col: (col == "patient_ID") or (col in dat_cols),
+        dtype={col: np.float64 for col in dat_cols},
+    )
+    return file_dat["patient_ID"].to_numpy(), file_dat[dat_cols].to_numpy()
+
+def _get_data(full_dat, patient_row_idxs, selected_ids, max_random_pick=None):
+    """
+    @param patient_row_idxs: dict mapping each patient id to its row indices in full_dat
+    """
     if max_random_pick is not None:
-        selected_rows = []
+        selected_row_idxs = []
         for p_stay_id in selected_ids:
-            stay_row_idxs = np.where(patient_ids == p_stay_id)[0]
+            stay_row_idxs = patient_row_idxs[p_stay_id]
             #print("STAY ROWS", stay_row_idxs, p_stay_id)
             if max_random_pick > stay_row_idxs.size:
                 selected_idxs = stay_row_idxs
             else:
                 selected_idxs = np.random.choice(stay_row_idxs, size=max_random_pick, replace=False)
-            selected_rows.append(full_dat[selected_idxs])
-        return np.concatenate(selected_rows)
+            selected_row_idxs.append(selected_idxs)
     else:
-        return np.concatenate([
-            full_dat[patient_ids == p_stay_id] for p_stay_id in selected_ids
-            ])
+        selected_row_idxs = [patient_row_idxs[p_stay_id] for p_stay_id in selected_ids]
+    # gather all the selected rows at once, so each row is only copied once
+    return full_dat[np.concatenate(selected_row_idxs)]
 
 def main():
     args = parse_args()
@@ -54,19 +71,24 @@ def main():
     np.random.seed(args.seed)
 
     # Prep data
-    dat = pd.concat([
-        pd.read_csv(dat_file, delimiter=",")
-        for dat_file in args.dat_files])
-    patient_ids = dat["patient_ID"].to_numpy()
-    dat = dat.iloc[:,np.concatenate([[4], np.arange(12, dat.shape[1])])].to_numpy()
-    col_vars = np.var(dat, axis=0)
-    dat = dat[:, col_vars > 0]
-    print("keep cols", np.sum(col_vars > 0))
+    file_dats = [_read_dat_file(dat_file) for dat_file in args.dat_files]
+    patient_ids = np.concatenate([file_ids for file_ids, _ in file_dats])
+    dat = np.concatenate([file_dat for _, file_dat in file_dats])
+    # the column moments are computed once and reused for normalizing the kept columns
+    col_means = np.mean(dat, axis=0)
+    col_vars = np.mean(np.square(dat - col_means), axis=0)
+    keep_cols = col_vars > 0
+    dat = dat[:, keep_cols]
+    col_means = col_means[keep_cols]
+    col_vars = col_vars[keep_cols]
+    print("keep cols", np.sum(keep_cols))
 
     # normalize
-    col_means = np.mean(dat[:,1:MAX_VARIABLES], axis=0, keepdims=True)
-    col_sds = np.sqrt(np.var(dat[:,1:MAX_VARIABLES], axis=0, keepdims=True))
-    dat[:,1:MAX_VARIABLES] = (dat[:,1:MAX_VARIABLES] - col_means)/col_sds
+    col_sds = np.sqrt(col_vars[1:MAX_VARIABLES])
+    dat[:,1:MAX_VARIABLES] = (dat[:,1:MAX_VARIABLES] - col_means[1:MAX_VARIABLES])/col_sds
+
+    # Row indices of each patient, so selecting a patient does not scan all the rows
+    patient_row_idxs = pd.Series(np.arange(patient_ids.size)).groupby(patient_ids).indices
 
     # Shuffle patient ids
     num_uniq_ids = np.unique(patient_ids).size
@@ -74,10 +96,10 @@ def main():
     logging.info("uniq patient ids %d, train %d", num_uniq_ids, args.init_train_n)
     rand_ids = np.random.choice(np.unique(patient_ids), num_uniq_ids, replace=False)
     init_train_idxs = rand_ids[:args.init_train_n]
-    init_train_dat = _get_data(dat, patient_ids, init_train_idxs, max_random_pick=args.random_pick_n)
+    init_train_dat = _get_data(dat, patient_row_idxs, init_train_idxs, max_random_pick=args.random_pick_n)
     start_idx = args.init_train_n
     reuse_test_idxs = rand_ids[start_idx: start_idx + args.reuse_test_n]
-    reuse_test_dat = _get_data(dat, patient_ids, reuse_test_idxs, max_random_pick=args.random_pick_n)
+    reuse_test_dat = _get_data(dat, patient_row_idxs, reuse_test_idxs, max_random_pick=args.random_pick_n)
     start_idx += args.reuse_test_n
     logging.info("num reuse %d", reuse_test_idxs.size)
     assert reuse_test_idxs.size == args.reuse_test_n
@@ -96,7 +118,7 @@ def main():
     for batch_start_idx in range(start_idx, rand_ids.size, args.train_batch_n):
         #batch_start_idx = start_idx + batch_idx * args.train_batch_n
         batch_ids = rand_ids[batch_start_idx: batch_start_idx + args.train_batch_n]
-        dat_slice = _get_data(dat, patient_ids, batch_ids, max_random_pick=args.random_pick_n)
+        dat_slice = _get_data(dat, patient_row_idxs, batch_ids, max_random_pick=args.random_pick_n)
         iid_train_dats.append(
                 Dataset(
                     x=dat_slice[:,1:MAX_VARIABLES],
@@ -117,6 +139,7 @@ def main():
                 "full_dat": full_dat,
             },
             f,
+            protocol=pickle.HIGHEST_PROTOCOL,
         )
 
 
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from dataset import Dataset, DatasetBuffer
+
+
+def _make_dat(rng, n, with_mu=True):
+    return Dataset(
+        x=rng.randn(n, 3),
+        y=(rng.rand(n, 1) > 0.5).astype(int),
+        mu=rng.rand(n, 1) if with_mu else None,
+    )
+
+
+def test_dataset_buffer_matches_merge():
+    rng = np.random.RandomState(0)
+    init_dat = _make_dat(rng, 5)
+    dat_stream = [_make_dat(rng, n) for n in [3, 0, 4, 2]]
+    buffer = DatasetBuffer(init_dat, dat_stream)
+    first_dat = buffer.dataset
+    merged_dat = init_dat
+    for batch in dat_stream:
+        buffer.append(batch)
+        merged_dat = Dataset.merge([merged_dat, batch])
+        buffer_dat = buffer.dataset
+        assert buffer_dat.size == merged_dat.size
+        assert np.array_equal(buffer_dat.x, merged_dat.x)
+        assert np.array_equal(buffer_dat.y, merged_dat.y)
+        assert np.array_equal(buffer_dat.mu, merged_dat.mu)
+        assert buffer_dat.weight is None
+    # datasets handed out earlier are not changed by later appends
+    assert first_dat.size == init_dat.size
+    assert np.array_equal(first_dat.x, init_dat.x)
+
+
+def test_dataset_buffer_without_mu():
+    rng = np.random.RandomState(1)
+    init_dat = _make_dat(rng, 4, with_mu=False)
+    batch = _make_dat(rng, 2, with_mu=False)
+    buffer = DatasetBuffer(init_dat, [batch])
+    buffer.append(batch)
+    assert buffer.dataset.mu is None
+    assert np.array_equal(buffer.dataset.x, np.vstack([init_dat.x, batch.x]))
+
+
+def test_dataset_buffer_rejects_mismatched_fields():
+    rng = np.random.RandomState(2)
+    init_dat = _make_dat(rng, 4)
+    batch = _make_dat(rng, 2, with_mu=False)
+    # the buffer would otherwise leave the rows of mu for this batch unset
+    with pytest.raises(AssertionError):
+        DatasetBuffer(init_dat, [batch]).append(batch)
+    with pytest.raises(AssertionError):
+        DatasetBuffer(batch, [init_dat]).append(init_dat)
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr, ndtri
+from sklearn.linear_model import LogisticRegression
+
+from dataset import Dataset
+from hypothesis_tester import AUCHypothesisTester, get_log_lik, get_sequential_boundary
+from model_developers import set_model
+from node import Node
+
+
+def test_sequential_boundary_independent_upper():
+    # P(Z1 < b1, Z2 > t) = ndtr(b1) * (1 - ndtr(t)) for independent statistics
+    alpha, b1 = 0.05, 1.2
+    prior_bounds = np.array([[-np.inf, b1]])
+    boundary = get_sequential_boundary(np.eye(2), prior_bounds, alpha, alt_greater=True)
+    assert np.isclose(boundary, ndtri(1 - alpha/ndtr(b1)), atol=1e-3)
+
+
+def test_sequential_boundary_independent_lower():
+    # P(Z1 < b1, Z2 < t) = ndtr(b1) * ndtr(t)
+    alpha, b1 = 0.05, 0.5
+    prior_bounds = np.array([[-np.inf, b1]])
+    boundary = get_sequential_boundary(np.eye(2), prior_bounds, alpha, alt_greater=False)
+    assert np.isclose(boundary, ndtri(alpha/ndtr(b1)), atol=1e-3)
+
+
+def test_sequential_boundary_scaled_cov():
+    # scaling the current statistic's variance scales its boundary
+    alpha, b1 = 0.1, 1.0
+    prior_bounds = np.array([[-np.inf, b1]])
+    cov_est = np.diag([1.0, 0.25])
+    boundary = get_sequential_boundary(cov_est, prior_bounds, alpha, alt_greater=True)
+    assert np.isclose(boundary, 0.5 * ndtri(1 - alpha/ndtr(b1)), atol=1e-3)
+
+
+def test_sequential_boundary_leaves_global_seed():
+    prior_bounds = np.array([[-np.inf, 1.0], [-np.inf, 1.5]])
+    cov_est = np.array([[1, 0.5, 0.3], [0.5, 1, 0.5], [0.3, 0.5, 1]])
+    np.random.seed(0)
+    boundary = get_sequential_boundary(cov_est, prior_bounds, 0.05, alt_greater=True)
+    draw = np.random.rand()
+    np.random.seed(0)
+    assert draw == np.random.rand()
+    assert boundary == get_sequential_boundary(cov_est, prior_bounds, 0.05, alt_greater=True)
+
+
+def test_log_lik_matches_baseline():
+    y_pred = np.array([0.0, 1e-12, 0.2, 0.5, 0.9, 1.0])
+    y_true = np.array([0, 1, 1, 0, 1, 0])
+    clipped = np.clip(y_pred, 1e-10, 1 - 1e-10)
+    baseline = y_true * np.log(clipped) + (1 - y_true) * np.log(1 - clipped)
+    assert np.allclose(get_log_lik(y_true, y_pred), baseline)
+    # column labels are reshaped to the predictions
+    assert np.allclose(get_log_lik(y_true.reshape((-1, 1)), y_pred), baseline)
+    # the input predictions are not modified
+    assert y_pred[0] == 0.0
+
+
+def test_log_lik_matches_baseline_on_float_labels():
+    # labels from the simulated and real datasets can be stored as floats, but must still be hard 0/1
+    y_pred = np.array([0.3, 0.6, 0.99])
+    y_true = np.array([[1.0], [0.0], [1.0]])
+    baseline = y_true.flatten() * np.log(y_pred) + (1 - y_true.flatten()) * np.log(1 - y_pred)
+    assert np.allclose(get_log_lik(y_true, y_pred), baseline)
+
+
+def test_orig_influence_func_cache_tracks_refits():
+    rng = np.random.RandomState(0)
+    x = rng.randn(200, 3)
+    y = (x[:, :1] + rng.randn(200, 1) > 0).astype(int)
+    tester = AUCHypothesisTester()
+    tester.set_test_dat(Dataset(x, y))
+
+    mdl = LogisticRegression()
+    set_model(mdl, np.array([0, 1.0, 0, 0]))
+    _, auc = tester._get_orig_influence_func(mdl)
+    # refit the same object in place
+    set_model(mdl, np.array([0, -1.0, 0, 0]))
+    _, refit_auc = tester._get_orig_influence_func(mdl)
+    assert np.isclose(refit_auc, tester.get_influence_func(mdl)[1])
+    assert np.isclose(refit_auc, 1 - auc)
+
+
+def _get_baseline_auc(test_y, score_y):
+    # pairwise comparison, as originally implemented
+    all_ranks = score_y[test_y == 0].reshape((1, -1)) < score_y[test_y == 1].reshape((-1, 1))
+    return np.mean(all_ranks)
+
+
+def test_auc_matches_pairwise_with_ties():
+    rng = np.random.RandomState(1)
+    test_y = (rng.rand(300) > 0.6).astype(int)
+    # rounding creates many ties between the classes
+    score_y = np.round(rng.randn(300) + test_y, 1)
+    tester = AUCHypothesisTester()
+    assert np.isclose(tester.get_auc(test_y, score_y), _get_baseline_auc(test_y, score_y))
+
+
+def test_auc_influence_func_matches_baseline():
+    rng = np.random.RandomState(2)
+    x = np.round(rng.randn(250, 2), 1)
+    y = (x[:, :1] + rng.randn(250, 1) > 0).astype(int)
+    mdl = LogisticRegression()
+    set_model(mdl, np.array([0.1, 0.8, -0.3]))
+    tester = AUCHypothesisTester()
+    tester.set_test_dat(Dataset(x, y))
+    influence_func, auc = tester.get_influence_func(mdl)
+
+    # baseline: per-observation empirical CDFs of the scores, compared against the same decision scores
+    # because predict_log_proba can round nearly equal logits into ties
+    pred_y = mdl.decision_function(x)
+    test_y = y.flatten()
+    prob_y1 = test_y.mean()
+    prob_y0 = 1 - prob_y1
+    mask_y0 = test_y == 0
+    mask_y1 = test_y == 1
+    cdf_score_y0 = np.array([np.mean(pred_y[mask_y0] < pred_y[i]) for i in range(y.size)])
+    cdf_score_y1 = np.array([np.mean(pred_y[mask_y1] > pred_y[i]) for i in range(y.size)])
+    baseline_auc = _get_baseline_auc(test_y, pred_y)
+    baseline_influence_func = (
+        mask_y1/prob_y1 * cdf_score_y0 + mask_y0/prob_y0 * cdf_score_y1
+        - (mask_y0/prob_y0 + mask_y1/prob_y1) * baseline_auc + baseline_auc
+    )
+    assert np.isclose(auc, baseline_auc)
+    assert np.allclose(influence_func, baseline_influence_func)
+
+
+def _make_node(obs):
+    node = Node(weight=1, history=[])
+    node.store_observations(pd.DataFrame(obs))
+    return node
+
+
+def test_cov_est_matches_np_cov():
+    rng = np.random.RandomState(3)
+    n = 100
+    tester = AUCHypothesisTester()
+    tester.set_test_dat(Dataset(np.zeros((n, 1)), np.zeros((n, 1))))
+    # nodes with one and two observation columns, as for the AUC and calibration testers
+    nodes = [_make_node(rng.randn(n, 1)), _make_node(rng.randn(n, 2)), _make_node(rng.randn(n, 1))]
+    for k in range(1, len(nodes) + 1):
+        # the prior blocks are reused from the previous iteration
+        cov_est = tester._get_cov_est(nodes[:k - 1], nodes[k - 1])
+        full_obs = np.hstack([node.obs.to_numpy() for node in nodes[:k]]).T
+        assert np.allclose(cov_est, np.atleast_2d(np.cov(full_obs))/n)
+
+
+def test_cov_est_refreshes_on_new_observations():
+    rng = np.random.RandomState(4)
+    n = 50
+    tester = AUCHypothesisTester()
+    tester.set_test_dat(Dataset(np.zeros((n, 1)), np.zeros((n, 1))))
+    prior_node = _make_node(rng.randn(n, 1))
+    node = _make_node(rng.randn(n, 1))
+    tester._get_cov_est([prior_node], node)
+    prior_node.store_observations(pd.DataFrame(rng.randn(n, 1)))
+    cov_est = tester._get_cov_est([prior_node], node)
+    full_obs = np.hstack([prior_node.obs.to_numpy(), node.obs.to_numpy()]).T
+    assert np.allclose(cov_est, np.cov(full_obs)/n)
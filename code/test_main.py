@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+
+from main import get_approval_counts
+
+
+def test_approval_counts_stay_numeric(tmp_path):
+    approve_df, count_df = get_approval_counts([0, 2, 3], max_iter=4)
+    assert np.array_equal(count_df.value, [0, 0, 1, 2, 2])
+    assert np.array_equal(approve_df.value, [0, 0, 1, 1, 1])
+
+    # concatenated with the float scores, as in main, and read back
+    scores_df = pd.DataFrame({"value": np.linspace(0.5, 0.9, 5), "time": np.arange(5)})
+    res_file = tmp_path / "res.csv"
+    pd.concat([scores_df, approve_df, count_df]).to_csv(res_file, index=False)
+    res = pd.read_csv(res_file)
+    assert res.value.dtype == np.float64
+    assert np.array_equal(res.value[res.variable == "did_approval"], [0, 0, 1, 1, 1])
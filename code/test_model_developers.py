@@ -0,0 +1,48 @@
+import numpy as np
+from scipy.special import ndtri
+
+from dataset import Dataset, DataGenerator
+from hypothesis_tester import LogLikHypothesisTester
+from model_developers import AdversaryLossModeler, get_test_power
+from mtp_mechanisms import BinaryThresholdMTP
+
+
+def test_test_power_at_null_is_alpha():
+    assert np.isclose(get_test_power(0.1, 2.0, 100, popmean=0.1, alpha=0.05), 0.05)
+
+
+def test_test_power_matches_simulated_z_test():
+    mu, var, num_test, popmean, alpha = 0.05, 0.5, 400, 0.0, 0.1
+    rng = np.random.RandomState(0)
+    obs = rng.normal(loc=mu, scale=np.sqrt(var), size=(20000, num_test))
+    z_stat = (obs.mean(axis=1) - popmean) / np.sqrt(var / num_test)
+    sim_power = np.mean(z_stat > ndtri(1 - alpha))
+    assert np.isclose(get_test_power(mu, var, num_test, popmean, alpha), sim_power, atol=0.01)
+
+
+def _make_adversary_dat(rng, n, beta):
+    x = rng.randn(n, beta.size)
+    # perturbing the last coefficient never moves the predictions, so the adversary skips it
+    x[:, -1] *= 1e-12
+    y = (rng.rand(n, 1) < 1/(1 + np.exp(-x @ beta))).astype(int)
+    return Dataset(x, y)
+
+
+def _run_adversary(beta, update_incr, maxfev):
+    rng = np.random.RandomState(0)
+    mtp_mech = BinaryThresholdMTP(LogLikHypothesisTester(), 0.1)
+    mtp_mech.init_test_dat(_make_adversary_dat(rng, 200, beta), maxfev)
+    modeler = AdversaryLossModeler(mtp_mech.hypo_tester, DataGenerator(beta, mean_x=0), update_incr=update_incr)
+    return modeler.simulate_approval_process(_make_adversary_dat(rng, 100, beta), mtp_mech, maxfev=maxfev)
+
+
+def test_adversary_sweeps_stay_within_coefs():
+    # skipped variables do not use up tests, so a sweep reaches the last coefficient before maxfev
+    test_hist = _run_adversary(np.array([[0.5], [0], [0]]), update_incr=0.1, maxfev=4)
+    assert test_hist.curr_time == 4
+
+
+def test_adversary_stops_when_nothing_can_be_tested():
+    # every perturbation is too small to move the predictions
+    test_hist = _run_adversary(np.array([[0.5], [0], [0]]), update_incr=1e-12, maxfev=4)
+    assert test_hist.curr_time == 0